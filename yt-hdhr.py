@@ -1,15 +1,24 @@
+import asyncio
+import io
 import subprocess
-import json
 import logging
+import re
+import select
 import socket
 import struct
 import threading
 import time
 import uuid
-import xml.etree.ElementTree as ET
-from xml.dom import minidom
-from datetime import datetime, timedelta
-from flask import Flask, request, Response, jsonify
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from lxml import etree as ET
+from lxml.builder import E
+from datetime import date, datetime, timezone
+from flask import Flask, request, Response, jsonify, send_file, send_from_directory
+from gunicorn.app.base import BaseApplication
+from werkzeug.security import safe_join
+import orjson
+import yt_dlp
 from urllib.parse import unquote
 import os
 
@@ -28,6 +37,9 @@ M3U_DIR = os.environ.get('M3U_DIR', '/data')
 HOST_IP = os.environ.get('HOST_IP', '192.168.1.123')
 SERVER_PORT = os.environ.get('SERVER_PORT', '6095')
 
+# Each /stream client holds a server thread for as long as it watches
+SERVER_THREADS = int(os.environ.get('SERVER_THREADS', '16'))
+
 # HDHomeRun emulation settings
 HDHR_DEVICE_ID = os.environ.get('HDHR_DEVICE_ID', None)
 HDHR_FRIENDLY_NAME = os.environ.get('HDHR_FRIENDLY_NAME', 'yt-hdhr')
@@ -44,16 +56,118 @@ def _generate_device_id():
 
 DEVICE_ID = HDHR_DEVICE_ID or _generate_device_id()
 
+# Shared lxml parser options for ytlinks.xml — drops whitespace-only text between
+# elements and skips building the unused xml:id index
+XML_PARSE_OPTIONS = {
+    'huge_tree': False,
+    'remove_blank_text': True,
+    'collect_ids': False,
+}
+
+# In-process cache of parsed channels, generated m3u/EPG content and served files.
+# Each entry is (source version, value); the version is the source file's mtime_ns,
+# so editing the file invalidates it.
+_xml_cache = {}
+
+
+def _cache_lookup(key, version):
+    """Return the cached value for key if it was built from the same source version, else None."""
+    entry = _xml_cache.get(key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    return None
+
+
+# {{HOST_IP}} / {{PORT}} placeholders in served m3u files and their values
+_PLACEHOLDER_RE = re.compile(rb'\{\{(HOST_IP|PORT)\}\}')
+_PLACEHOLDER_VALUES = {b'HOST_IP': HOST_IP.encode('utf-8'), b'PORT': SERVER_PORT.encode('utf-8')}
+
+
+def _read_data_file(filepath):
+    """Return (mtime_ns, bytes) with {{HOST_IP}}/{{PORT}} filled in, cached until the file's mtime changes."""
+    mtime_ns = os.stat(filepath).st_mtime_ns
+    cache_key = ('file', filepath)
+    content = _cache_lookup(cache_key, mtime_ns)
+    if content is None:
+        with open(filepath, 'rb') as f:
+            content = f.read()
+        content = _PLACEHOLDER_RE.sub(lambda m: _PLACEHOLDER_VALUES[m.group(1)], content)
+        _xml_cache[cache_key] = (mtime_ns, content)
+    return mtime_ns, content
+
+
+def _write_data_file(filepath, content):
+    """Write a generated file via a temp file and os.replace, so readers never see it half-written."""
+    tmp_path = f'{filepath}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, filepath)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# <channel> child tags in ytlinks.xml and the channel dict keys they map to
+CHANNEL_FIELDS = {
+    'channel-name': 'name',
+    'tvg-id': 'tvg_id',
+    'tvg-name': 'tvg_name',
+    'tvg-logo': 'tvg_logo',
+    'group-title': 'group_title',
+    'channel-number': 'channel_number',
+    'yt-url': 'yt_url',
+}
+
+
+def _parse_channels(xml_path):
+    """Parse a ytlinks.xml file into a list of channel dicts with defaults applied.
+
+    Channels are streamed with iterparse and each element is cleared once read.
+    Channels without a yt-url are skipped. The result is cached by the file's
+    mtime, so the m3u, EPG and lineup paths share a single parse. Raises
+    ET.ParseError if the XML is malformed.
+    """
+    mtime_ns = os.stat(xml_path).st_mtime_ns
+    cache_key = ('channels', xml_path)
+    cached = _cache_lookup(cache_key, mtime_ns)
+    if cached is not None:
+        return cached
+
+    channels = []
+    for idx, (_, elem) in enumerate(ET.iterparse(xml_path, events=('end',), tag='channel', **XML_PARSE_OPTIONS), start=1):
+        ch = {CHANNEL_FIELDS[child.tag]: (child.text or '').strip() for child in elem if child.tag in CHANNEL_FIELDS}
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+        ch.setdefault('name', ch.get('tvg_name', 'Unknown'))
+        ch.setdefault('tvg_id', '')
+        ch.setdefault('tvg_name', ch['name'])
+        ch.setdefault('tvg_logo', '')
+        ch.setdefault('group_title', 'General')
+        ch.setdefault('channel_number', str(idx))
+        if not ch.get('yt_url'):
+            logging.warning(f"Skipping channel '{ch['name']}' due to missing YouTube URL.")
+            continue
+        channels.append(ch)
+
+    _xml_cache[cache_key] = (mtime_ns, channels)
+    return channels
+
 # ─── SSDP Discovery ──────────────────────────────────────────────────────────
 
 SSDP_MULTICAST = '239.255.255.250'
 SSDP_PORT = 1900
 SSDP_DEVICE_TYPE = 'urn:schemas-upnp-org:device:MediaServer:1'
+# Repeat M-SEARCHes from the same source inside this window (seconds) get no extra reply
+SSDP_DEDUPE_WINDOW = 1.0
 
 
-def ssdp_response(addr, host_ip, port):
-    """Send an SSDP M-SEARCH response to the requesting address."""
-    response = (
+def ssdp_search_response(host_ip, port):
+    """Build the SSDP M-SEARCH response payload advertising this device."""
+    return (
         f'HTTP/1.1 200 OK\r\n'
         f'CACHE-CONTROL: max-age=1800\r\n'
         f'EXT:\r\n'
@@ -62,16 +176,40 @@ def ssdp_response(addr, host_ip, port):
         f'ST: {SSDP_DEVICE_TYPE}\r\n'
         f'USN: uuid:{DEVICE_ID}::{SSDP_DEVICE_TYPE}\r\n'
         f'\r\n'
-    )
-    try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        sock.sendto(response.encode('utf-8'), addr)
-        sock.close()
-    except Exception as e:
-        logging.warning(f'SSDP response error: {e}')
+    ).encode('utf-8')
+
+
+class SSDPProtocol(asyncio.DatagramProtocol):
+    """Answer SSDP M-SEARCH requests for this device on the SSDP event loop."""
+
+    def __init__(self, host_ip, port):
+        # The response never changes, so encode it once rather than per request
+        self.response = ssdp_search_response(host_ip, port)
+        self.search_target = SSDP_DEVICE_TYPE.encode('utf-8')
+        self.last_reply = {}
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if b'M-SEARCH' not in data or self.search_target not in data:
+            return
+        now = time.monotonic()
+        if now - self.last_reply.get(addr, -SSDP_DEDUPE_WINDOW) < SSDP_DEDUPE_WINDOW:
+            return
+        if len(self.last_reply) > 256:
+            self.last_reply = {a: t for a, t in self.last_reply.items() if now - t < SSDP_DEDUPE_WINDOW}
+        self.last_reply[addr] = now
+        logging.info(f'Received SSDP M-SEARCH from {addr}')
+        # Reply from the listening socket instead of opening one per request
+        self.transport.sendto(self.response, addr)
 
+    def error_received(self, exc):
+        logging.warning(f'SSDP response error: {exc}')
 
-def ssdp_listener(host_ip, port):
+
+async def ssdp_listener(host_ip, port):
     """Listen for SSDP M-SEARCH requests and respond."""
     try:
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
@@ -81,17 +219,14 @@ def ssdp_listener(host_ip, port):
         # Join the multicast group
         mreq = struct.pack('4sL', socket.inet_aton(SSDP_MULTICAST), socket.INADDR_ANY)
         sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: SSDPProtocol(host_ip, port), sock=sock)
         logging.info(f'SSDP listener started on {SSDP_MULTICAST}:{SSDP_PORT}')
-        while True:
-            data, addr = sock.recvfrom(1024)
-            if b'M-SEARCH' in data and SSDP_DEVICE_TYPE.encode('utf-8') in data:
-                logging.info(f'Received SSDP M-SEARCH from {addr}')
-                ssdp_response(addr, host_ip, port)
     except Exception as e:
         logging.error(f'SSDP listener error: {e}')
 
 
-def ssdp_broadcaster(host_ip, port):
+async def ssdp_broadcaster(host_ip, port):
     """Periodically broadcast SSDP NOTIFY (alive) messages."""
     notify = (
         f'NOTIFY * HTTP/1.1\r\n'
@@ -103,158 +238,182 @@ def ssdp_broadcaster(host_ip, port):
         f'NTS: ssdp:alive\r\n'
         f'USN: uuid:{DEVICE_ID}::{SSDP_DEVICE_TYPE}\r\n'
         f'\r\n'
-    )
+    ).encode('utf-8')
     try:
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
         sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+        transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            asyncio.DatagramProtocol, sock=sock)
         logging.info(f'SSDP broadcaster started for {host_ip}:{port}')
         while True:
-            sock.sendto(notify.encode('utf-8'), (SSDP_MULTICAST, SSDP_PORT))
-            time.sleep(30)
+            transport.sendto(notify, (SSDP_MULTICAST, SSDP_PORT))
+            await asyncio.sleep(30)
     except Exception as e:
         logging.error(f'SSDP broadcaster error: {e}')
 
 
 def start_ssdp(host_ip, port):
-    """Start SSDP listener and broadcaster in background daemon threads."""
-    threading.Thread(target=ssdp_listener, args=(host_ip, port), daemon=True).start()
-    threading.Thread(target=ssdp_broadcaster, args=(host_ip, port), daemon=True).start()
+    """Start the SSDP listener and broadcaster on one asyncio loop in a background daemon thread."""
+    loop = asyncio.new_event_loop()
+    loop.create_task(ssdp_listener(host_ip, port))
+    loop.create_task(ssdp_broadcaster(host_ip, port))
+    threading.Thread(target=loop.run_forever, name='ssdp', daemon=True).start()
     logging.info(f'SSDP services started — device {DEVICE_ID} on {host_ip}:{port}')
 
-def generate_m3u_from_xml_file(xml_path, output_path):
-    """Parse a ytlinks.xml file and write a ytlive.m3u playlist."""
+# #EXTINF line for each playlist entry. M3U has no escaping and players show
+# values literally, so the only fix-up is keeping a '"' from ending its quoted
+# attribute: it becomes ' in text values and %22 in the logo URL
+_EXTINF_TMPL = ('#EXTINF:-1 tvg-id="{tvg_id}" tvg-name="{tvg_name}" tvg-chno="{channel_number}"'
+                ' tvg-logo="{tvg_logo}" group-title="{group_title}",{name}\n')
+_TEXT_QUOTE_FIX = str.maketrans('"', "'")
+_URL_QUOTE_FIX = str.maketrans({'"': '%22'})
+_EXTINF_ATTRS = {
+    'tvg_id': _TEXT_QUOTE_FIX,
+    'tvg_name': _TEXT_QUOTE_FIX,
+    'channel_number': _TEXT_QUOTE_FIX,
+    'tvg_logo': _URL_QUOTE_FIX,
+    'group_title': _TEXT_QUOTE_FIX,
+}
+
+
+def generate_m3u_from_xml_file(xml_path, output_path=None):
+    """Parse a ytlinks.xml file into a ytlive.m3u playlist.
+
+    Returns the playlist bytes, or None on failure. The playlist is also written
+    to output_path when one is given.
+    """
     if not os.path.isfile(xml_path):
         logging.warning(f"XML file not found at {xml_path}, skipping m3u generation.")
-        return False
+        return None
+
+    # Skip the parse and write when the XML is unchanged since the last run
+    mtime_ns = os.stat(xml_path).st_mtime_ns
+    cache_key = ('m3u', xml_path, output_path)
+    cached = _cache_lookup(cache_key, mtime_ns)
+    if cached is not None and (output_path is None or os.path.isfile(output_path)):
+        return cached
 
     try:
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
+        channels = _parse_channels(xml_path)
     except ET.ParseError as e:
         logging.error(f"Failed to parse XML file {xml_path}: {str(e)}")
-        return False
-
-    base_url = f'http://{HOST_IP}:{SERVER_PORT}'
-    lines = ['#EXTM3U']
-    for idx, channel in enumerate(root.findall('channel'), start=1):
-        name = (channel.find('channel-name').text or '').strip() if channel.find('channel-name') is not None else 'Unknown'
-        tvg_id = (channel.find('tvg-id').text or '').strip() if channel.find('tvg-id') is not None else ''
-        tvg_name = (channel.find('tvg-name').text or '').strip() if channel.find('tvg-name') is not None else name
-        tvg_logo = (channel.find('tvg-logo').text or '').strip() if channel.find('tvg-logo') is not None else ''
-        group_title = (channel.find('group-title').text or '').strip() if channel.find('group-title') is not None else 'General'
-        channel_number = (channel.find('channel-number').text or '').strip() if channel.find('channel-number') is not None else str(idx)
-        yt_url = (channel.find('yt-url').text or '').strip() if channel.find('yt-url') is not None else ''
-
-        if not yt_url:
-            logging.warning(f"Skipping channel '{name}' due to missing YouTube URL.")
-            continue
-
-        lines.append(
-            f'#EXTINF:-1 tvg-id="{tvg_id}" tvg-name="{tvg_name}"'
-            f' tvg-chno="{channel_number}" tvg-logo="{tvg_logo}" group-title="{group_title}",{name}'
-        )
-        lines.append(f'{base_url}/stream?url={yt_url}')
+        return None
 
-    content = '\n'.join(lines) + '\n'
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(content)
-    logging.info(f"Generated {output_path} from {xml_path} with {len(lines) - 1} entries.")
-    return True
-
-def generate_epg_from_xml_file(xml_path, output_path):
-    """Parse a ytlinks.xml file and generate an XMLTV EPG file."""
+    stream_url = f'http://{HOST_IP}:{SERVER_PORT}/stream?url='
+    content = bytearray(b'#EXTM3U\n')
+    for ch in channels:
+        fields = dict(ch)
+        for key, quote_fix in _EXTINF_ATTRS.items():
+            fields[key] = fields[key].translate(quote_fix)
+        content += _EXTINF_TMPL.format_map(fields).encode('utf-8')
+        content += f'{stream_url}{ch["yt_url"]}\n'.encode('utf-8')
+    content = bytes(content)
+
+    if output_path is not None:
+        _write_data_file(output_path, content)
+    _xml_cache[cache_key] = (mtime_ns, content)
+    logging.info(f"Generated {output_path or 'm3u in memory'} from {xml_path} with {len(channels) * 2} entries.")
+    return content
+
+def generate_epg_from_xml_file(xml_path, output_path=None):
+    """Parse a ytlinks.xml file into an XMLTV EPG.
+
+    Returns the EPG bytes, or None on failure. The EPG is also written to
+    output_path when one is given.
+    """
     if not os.path.isfile(xml_path):
         logging.warning(f"XML file not found at {xml_path}, skipping EPG generation.")
-        return False
+        return None
+
+    # Programme windows start at today's UTC midnight, so the date is part of the version
+    now = datetime.now(timezone.utc)
+    version = (os.stat(xml_path).st_mtime_ns, now.date())
+    cache_key = ('epg', xml_path, output_path)
+    cached = _cache_lookup(cache_key, version)
+    if cached is not None and (output_path is None or os.path.isfile(output_path)):
+        return cached
 
     try:
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
+        channels = _parse_channels(xml_path)
     except ET.ParseError as e:
         logging.error(f"Failed to parse XML file {xml_path}: {str(e)}")
-        return False
+        return None
 
-    tv = ET.Element('tv')
-    tv.set('generator-info-name', 'yt-hdhr')
-    tv.set('generator-info-url', f'http://{HOST_IP}:{SERVER_PORT}')
+    # The 7 daily programme windows are the same for every channel; each day's
+    # stop is the next day's start, so 8 UTC midnights cover them. The time part
+    # is always 000000, so the stamps are built from the date alone
+    today = now.toordinal()
+    midnights = [f'{d.year:04d}{d.month:02d}{d.day:02d}000000 +0000'
+                 for d in map(date.fromordinal, range(today, today + 8))]
+    day_windows = list(zip(midnights, midnights[1:]))
 
-    now = datetime.utcnow()
     channel_count = 0
 
-    for idx, channel in enumerate(root.findall('channel'), start=1):
-        tvg_id = (channel.find('tvg-id').text or '').strip() if channel.find('tvg-id') is not None else ''
-        tvg_name = (channel.find('tvg-name').text or '').strip() if channel.find('tvg-name') is not None else ''
-        name = (channel.find('channel-name').text or '').strip() if channel.find('channel-name') is not None else tvg_name
-        tvg_logo = (channel.find('tvg-logo').text or '').strip() if channel.find('tvg-logo') is not None else ''
-        channel_number = (channel.find('channel-number').text or '').strip() if channel.find('channel-number') is not None else str(idx)
-        yt_url = (channel.find('yt-url').text or '').strip() if channel.find('yt-url') is not None else ''
-
-        if not tvg_id or not yt_url:
-            continue
-
-        # Channel element
-        ch_elem = ET.SubElement(tv, 'channel')
-        ch_elem.set('id', tvg_id)
-        display_name = ET.SubElement(ch_elem, 'display-name')
-        display_name.text = tvg_name or name
-        chnum_name = ET.SubElement(ch_elem, 'display-name')
-        chnum_name.text = channel_number
-        if tvg_logo:
-            icon = ET.SubElement(ch_elem, 'icon')
-            icon.set('src', tvg_logo)
-
-        # Programme element — 24-hour live block repeated for 7 days
-        for day_offset in range(7):
-            start_time = (now + timedelta(days=day_offset)).replace(hour=0, minute=0, second=0, microsecond=0)
-            end_time = start_time + timedelta(days=1)
-            start_str = start_time.strftime('%Y%m%d%H%M%S') + ' +0000'
-            end_str = end_time.strftime('%Y%m%d%H%M%S') + ' +0000'
-
-            prog = ET.SubElement(tv, 'programme')
-            prog.set('start', start_str)
-            prog.set('stop', end_str)
-            prog.set('channel', tvg_id)
-            title = ET.SubElement(prog, 'title')
-            title.set('lang', 'en')
-            title.text = f'{tvg_name or name} - Live'
-            desc = ET.SubElement(prog, 'desc')
-            desc.set('lang', 'en')
-            desc.text = f'Live stream from {name}'
-            if tvg_logo:
-                prog_icon = ET.SubElement(prog, 'icon')
-                prog_icon.set('src', tvg_logo)
-
-        channel_count += 1
-
-    # Pretty print the XML
-    xml_str = ET.tostring(tv, encoding='unicode', xml_declaration=False)
-    xml_str = '<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE tv SYSTEM "xmltv.dtd">\n' + xml_str
-    parsed = minidom.parseString(xml_str)
-    pretty_xml = parsed.toprettyxml(indent='  ', encoding='UTF-8').decode('utf-8')
-    # Remove extra XML declaration added by minidom
-    lines = pretty_xml.split('\n')
-    if lines[0].startswith('<?xml'):
-        lines[0] = '<?xml version="1.0" encoding="UTF-8"?>'
-    pretty_xml = '\n'.join(lines)
-
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(pretty_xml)
-    logging.info(f"Generated EPG {output_path} from {xml_path} with {channel_count} channels.")
-    return True
+    # Serialize each channel and its programmes as they are built rather than
+    # holding the whole <tv> tree in memory until the end. Each element is
+    # indented one level so the file keeps the usual pretty-printed layout
+    buf = io.BytesIO()
+    with ET.xmlfile(buf, encoding='UTF-8') as xf:
+        xf.write_declaration()
+        xf.write_doctype('<!DOCTYPE tv SYSTEM "xmltv.dtd">')
+        with xf.element('tv', {'generator-info-name': 'yt-hdhr', 'generator-info-url': f'http://{HOST_IP}:{SERVER_PORT}'}):
+            for ch in channels:
+                tvg_id = ch['tvg_id']
+                name = ch['name']
+                display = ch['tvg_name'] or name
+                tvg_logo = ch['tvg_logo']
+
+                if not tvg_id:
+                    continue
+
+                # Channel element
+                ch_elem = E.channel(E('display-name', display), E('display-name', ch['channel_number']), id=tvg_id)
+                if tvg_logo:
+                    ch_elem.append(E.icon(src=tvg_logo))
+                ET.indent(ch_elem, level=1)
+                xf.write('\n  ', ch_elem)
+
+                # Programme element — 24-hour live block repeated for 7 days
+                for start_str, end_str in day_windows:
+                    prog = E.programme(
+                        E.title(f'{display} - Live', lang='en'),
+                        E.desc(f'Live stream from {name}', lang='en'),
+                        start=start_str, stop=end_str, channel=tvg_id,
+                    )
+                    if tvg_logo:
+                        prog.append(E.icon(src=tvg_logo))
+                    ET.indent(prog, level=1)
+                    xf.write('\n  ', prog)
+
+                channel_count += 1
+            xf.write('\n')
+    buf.write(b'\n')
+    pretty_xml = buf.getvalue()
+
+    if output_path is not None:
+        _write_data_file(output_path, pretty_xml)
+    _xml_cache[cache_key] = (version, pretty_xml)
+    logging.info(f"Generated EPG {output_path or 'in memory'} from {xml_path} with {channel_count} channels.")
+    return pretty_xml
 
 @app.route('/m3u/<path:filename>', methods=['GET'])
 def serve_m3u(filename):
     """Serve .m3u files from the configured directory, replacing {{HOST_IP}} and {{PORT}} placeholders."""
     if not filename.endswith('.m3u'):
         return jsonify({'error': 'Only .m3u files can be served'}), 400
-    filepath = os.path.join(M3U_DIR, filename)
-    if not os.path.isfile(filepath):
+    # Refuse paths outside M3U_DIR, as send_from_directory does for the other file routes
+    filepath = safe_join(M3U_DIR, filename)
+    if filepath is None or not os.path.isfile(filepath):
         return jsonify({'error': 'File not found'}), 404
-    with open(filepath, 'r', encoding='utf-8') as f:
-        content = f.read()
-    content = content.replace('{{HOST_IP}}', HOST_IP)
-    content = content.replace('{{PORT}}', SERVER_PORT)
-    return Response(content, content_type='audio/x-mpegurl')
+    # Placeholders mean the file can't be sent as-is, so send the cached substituted bytes
+    mtime_ns, content = _read_data_file(filepath)
+    return send_file(
+        io.BytesIO(content),
+        mimetype='audio/x-mpegurl',
+        conditional=True,
+        etag=f'{mtime_ns:x}-{len(content):x}',
+        last_modified=mtime_ns / 1e9,
+    )
 
 @app.route('/xml/<path:filename>', methods=['GET'])
 def serve_xml(filename):
@@ -264,9 +423,7 @@ def serve_xml(filename):
     filepath = os.path.join(M3U_DIR, filename)
     if not os.path.isfile(filepath):
         return jsonify({'error': 'File not found'}), 404
-    with open(filepath, 'r', encoding='utf-8') as f:
-        content = f.read()
-    return Response(content, content_type='application/xml')
+    return send_from_directory(M3U_DIR, filename, mimetype='application/xml', conditional=True)
 
 @app.route('/generate', methods=['GET'])
 def generate_m3u_from_xml():
@@ -279,11 +436,9 @@ def generate_m3u_from_xml():
     output_filename = os.path.splitext(xml_filename)[0] + '.m3u'
     output_path = os.path.join(M3U_DIR, output_filename)
 
-    if not generate_m3u_from_xml_file(xml_path, output_path):
+    content = generate_m3u_from_xml_file(xml_path, output_path)
+    if content is None:
         return jsonify({'error': 'Failed to generate m3u from XML'}), 500
-
-    with open(output_path, 'r', encoding='utf-8') as f:
-        content = f.read()
     return Response(content, content_type='audio/x-mpegurl')
 
 @app.route('/epg', methods=['GET'])
@@ -297,11 +452,9 @@ def generate_epg():
     output_filename = os.path.splitext(xml_filename)[0] + '_epg.xml'
     output_path = os.path.join(M3U_DIR, output_filename)
 
-    if not generate_epg_from_xml_file(xml_path, output_path):
+    content = generate_epg_from_xml_file(xml_path, output_path)
+    if content is None:
         return jsonify({'error': 'Failed to generate EPG'}), 500
-
-    with open(output_path, 'r', encoding='utf-8') as f:
-        content = f.read()
     return Response(content, content_type='application/xml')
 
 @app.route('/epg/<path:filename>', methods=['GET'])
@@ -312,9 +465,7 @@ def serve_epg(filename):
     filepath = os.path.join(M3U_DIR, filename)
     if not os.path.isfile(filepath):
         return jsonify({'error': 'File not found'}), 404
-    with open(filepath, 'r', encoding='utf-8') as f:
-        content = f.read()
-    return Response(content, content_type='application/xml')
+    return send_from_directory(M3U_DIR, filename, mimetype='application/xml', conditional=True)
 
 def get_channels_from_xml():
     """Read channel list from ytlinks.xml. Returns a list of dicts."""
@@ -322,35 +473,18 @@ def get_channels_from_xml():
     if not os.path.isfile(xml_path):
         return []
     try:
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
+        return _parse_channels(xml_path)
     except ET.ParseError:
         return []
 
-    channels = []
-    for idx, ch in enumerate(root.findall('channel'), start=1):
-        name = (ch.find('channel-name').text or '').strip() if ch.find('channel-name') is not None else 'Unknown'
-        tvg_id = (ch.find('tvg-id').text or '').strip() if ch.find('tvg-id') is not None else ''
-        tvg_name = (ch.find('tvg-name').text or '').strip() if ch.find('tvg-name') is not None else name
-        tvg_logo = (ch.find('tvg-logo').text or '').strip() if ch.find('tvg-logo') is not None else ''
-        group_title = (ch.find('group-title').text or '').strip() if ch.find('group-title') is not None else 'General'
-        channel_number = (ch.find('channel-number').text or '').strip() if ch.find('channel-number') is not None else str(idx)
-        yt_url = (ch.find('yt-url').text or '').strip() if ch.find('yt-url') is not None else ''
-        if yt_url:
-            channels.append({
-                'name': name,
-                'tvg_id': tvg_id,
-                'tvg_name': tvg_name,
-                'tvg_logo': tvg_logo,
-                'group_title': group_title,
-                'channel_number': channel_number,
-                'yt_url': yt_url,
-            })
-    return channels
-
 
 # ─── HDHomeRun Emulation Endpoints ───────────────────────────────────────────
 
+def json_response(data):
+    """Serialize data straight to bytes with orjson for the frequently polled HDHR endpoints."""
+    return Response(orjson.dumps(data), content_type='application/json')
+
+
 @app.route('/discover.json', methods=['GET'])
 def hdhr_discover():
     """HDHomeRun device discovery — used by Plex to detect the tuner."""
@@ -367,7 +501,7 @@ def hdhr_discover():
         'LineupURL': f'{base_url}/lineup.json',
         'TunerCount': HDHR_TUNER_COUNT,
     }
-    return jsonify(data)
+    return json_response(data)
 
 
 @app.route('/lineup.json', methods=['GET'])
@@ -385,7 +519,7 @@ def hdhr_lineup():
         if ch.get('tvg_logo'):
             entry['Station'] = ch['channel_number']
         lineup.append(entry)
-    return Response(json.dumps(lineup), content_type='application/json')
+    return json_response(lineup)
 
 
 @app.route('/lineup_status.json', methods=['GET'])
@@ -397,20 +531,17 @@ def hdhr_lineup_status():
         'Source': 'Cable',
         'SourceList': ['Cable'],
     }
-    return jsonify(data)
+    return json_response(data)
 
 
-@app.route('/device.xml', methods=['GET'])
-def hdhr_device_xml():
-    """HDHomeRun device descriptor XML — used by SSDP discovery."""
-    base_url = f'http://{HOST_IP}:{SERVER_PORT}'
-    xml_response = f"""<?xml version="1.0" encoding="UTF-8"?>
+# The device descriptor only depends on startup settings, so it is rendered once
+DEVICE_XML = f"""<?xml version="1.0" encoding="UTF-8"?>
 <root xmlns="urn:schemas-upnp-org:device-1-0">
     <specVersion>
         <major>1</major>
         <minor>0</minor>
     </specVersion>
-    <URLBase>{base_url}</URLBase>
+    <URLBase>http://{HOST_IP}:{SERVER_PORT}</URLBase>
     <device>
         <deviceType>urn:schemas-upnp-org:device:MediaServer:1</deviceType>
         <friendlyName>{HDHR_FRIENDLY_NAME}</friendlyName>
@@ -420,8 +551,13 @@ def hdhr_device_xml():
         <serialNumber></serialNumber>
         <UDN>uuid:{DEVICE_ID}</UDN>
     </device>
-</root>"""
-    return Response(xml_response.strip(), content_type='application/xml')
+</root>""".strip().encode('utf-8')
+
+
+@app.route('/device.xml', methods=['GET'])
+def hdhr_device_xml():
+    """HDHomeRun device descriptor XML — used by SSDP discovery."""
+    return Response(DEVICE_XML, content_type='application/xml')
 
 
 @app.route('/lineup.post', methods=['POST', 'GET'])
@@ -430,6 +566,119 @@ def hdhr_lineup_post():
     return Response('', status=200)
 
 
+# Bounded pool for yt-dlp URL resolution so concurrent /stream requests
+# (e.g. a Plex channel scan) queue up instead of all running probes at once
+STREAM_PROBE_POOL = ThreadPoolExecutor(max_workers=HDHR_TUNER_COUNT * 2)
+STREAM_PROBE_TIMEOUT = 20
+YT_DLP_TIMEOUT = 15
+YT_DLP_OPTIONS = {
+    'quiet': True,
+    'no_warnings': True,
+    'skip_download': True,
+    'socket_timeout': YT_DLP_TIMEOUT,
+}
+# Resolved stream URLs are reused for a few minutes, so repeat viewers of a
+# channel skip yt-dlp; googlevideo URLs stay valid for hours
+YT_DLP_CACHE_TTL = 300
+_resolved_urls = {}
+# A streamlink that has produced nothing after this many seconds is treated as failed
+STREAMLINK_START_TIMEOUT = 30
+# By default streamlink only logs errors, captured on a pipe so a failed start can
+# report them. With STREAMLINK_DEBUG it logs at debug level straight to our own
+# stderr (the container log), since nothing reads the pipe once a stream is running
+STREAMLINK_DEBUG = bool(os.environ.get('STREAMLINK_DEBUG'))
+STREAMLINK_LOGLEVEL = 'debug' if STREAMLINK_DEBUG else 'error'
+STREAMLINK_STDERR = None if STREAMLINK_DEBUG else subprocess.PIPE
+# URLs that get the yt-dlp fallback when streamlink can't open them directly
+_YT_RE = re.compile(r'(?:youtube\.com|youtu\.be)', re.I)
+
+# Relay MPEG-TS in 64 KiB reads straight off the pipe fd, and give streamlink a
+# 1 MiB kernel pipe buffer (Linux only) to absorb its bursty HLS segment output
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_PIPE_SIZE = 1024 * 1024
+
+
+def resolve_youtube_url(url):
+    """Resolve a YouTube page URL to a direct stream URL with the yt-dlp library.
+
+    Runs in-process rather than spawning the yt-dlp CLI. Returns None on failure;
+    network reads time out after YT_DLP_TIMEOUT. Successful results are cached
+    for YT_DLP_CACHE_TTL seconds.
+    """
+    now = time.monotonic()
+    cached = _resolved_urls.get(url)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+
+    # YoutubeDL instances aren't thread-safe, so each probe gets its own
+    try:
+        with yt_dlp.YoutubeDL(YT_DLP_OPTIONS) as ydl:
+            info = ydl.extract_info(url, download=False)
+    except yt_dlp.utils.DownloadError as e:
+        logging.error(f'yt-dlp error: {e}')
+        return None
+    resolved = info.get('url')
+    if not resolved:
+        logging.error(f'yt-dlp found no single stream URL for {url}')
+        return None
+    if len(_resolved_urls) > 256:
+        # Snapshot the items, since other probe threads may be adding entries
+        for key in [k for k, (expires, _) in list(_resolved_urls.items()) if expires <= now]:
+            _resolved_urls.pop(key, None)
+    _resolved_urls[url] = (now + YT_DLP_CACHE_TTL, resolved)
+    return resolved
+
+
+def start_streamlink(url):
+    """Start streamlink relaying the best quality of url to stdout.
+
+    Waits for the first chunk of output so a failed start is caught before the
+    response begins. Returns (process, first_chunk); first_chunk is empty if
+    streamlink exited without producing any data, or produced none within
+    STREAMLINK_START_TIMEOUT (the process is then terminated).
+    """
+    command = [
+        'streamlink',
+        url,
+        'best',
+        '--hls-live-restart',
+        '--loglevel', STREAMLINK_LOGLEVEL,
+        '--stdout'
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=STREAMLINK_STDERR,
+                               bufsize=0, pipesize=STREAM_PIPE_SIZE)
+    fd = process.stdout.fileno()
+    if not select.select([fd], [], [], STREAMLINK_START_TIMEOUT)[0]:
+        logging.error(f'Streamlink produced no output for {url} within {STREAMLINK_START_TIMEOUT}s')
+        process.terminate()
+        return process, b''
+    first_chunk = os.read(fd, STREAM_CHUNK_SIZE)
+    return process, first_chunk
+
+
+def _failed_stream_error(process):
+    """Reap a streamlink process that exited without output and return its stderr.
+
+    If the pipes aren't closed within 5 seconds (a child ignoring SIGTERM, or a
+    grandchild still holding them) the process is killed and whatever stderr
+    arrived so far is returned.
+    """
+    try:
+        _, error = process.communicate(timeout=5)
+    except subprocess.TimeoutExpired as e:
+        process.kill()
+        process.wait()
+        process.stdout.close()
+        if process.stderr:
+            process.stderr.close()
+        error = e.stderr or b''
+    if process.stderr is None:
+        return 'Streamlink output was logged to the server console (STREAMLINK_DEBUG)'
+    error_msg = error.decode('utf-8', errors='replace')
+    logging.error(f'Streamlink error: {error_msg}')
+    return error_msg
+
+
 @app.route('/stream', methods=['GET'])
 def stream():
     url = unquote(request.args.get('url'))  # Decode URL-encoded characters
@@ -437,61 +686,40 @@ def stream():
         return jsonify({'error': 'URL parameter is required'}), 400
 
     try:
-        # Get stream info with more detailed output
-        info_command = ['streamlink', '--json', '--loglevel', 'debug', url]
-        info_process = subprocess.Popen(info_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        info_output, info_error = info_process.communicate()
-
-        if info_process.returncode != 0:
-            error_msg = info_error.decode('utf-8', errors='replace')
-            logging.error(f'Streamlink error: {error_msg}')
-            return jsonify({'error': 'Failed to retrieve stream info', 'details': error_msg}), 500
-
-        # Parse the JSON output
-        stream_info = json.loads(info_output.decode('utf-8', errors='replace'))
-
-        # Check if streams are available
-        if 'streams' not in stream_info or not stream_info['streams']:
-            if 'youtube.com' in url.lower() or 'youtu.be' in url.lower():
-                yt_command = ['yt-dlp', '--get-url', '--youtube-skip-dash-manifest', url]
-                yt_process = subprocess.Popen(yt_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                yt_url, yt_error = yt_process.communicate()
-                
-                if yt_process.returncode != 0:
-                    logging.error(f'yt-dlp error: {yt_error.decode("utf-8", errors="replace")}')
-                    return jsonify({'error': 'No valid streams found'}), 404
-                
-                url = yt_url.decode('utf-8', errors='replace').strip()
-                info_command = ['streamlink', '--json', url]
-                info_process = subprocess.Popen(info_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                info_output, info_error = info_process.communicate()
-                stream_info = json.loads(info_output.decode('utf-8', errors='replace'))
-
-        best_quality = stream_info['streams'].get('best')
-        if not best_quality:
-            return jsonify({'error': 'No valid streams found'}), 404
-
-        # Command to run Streamlink
-        command = [
-            'streamlink',
-            url,
-            'best',
-            '--hls-live-restart',
-            '--stdout'
-        ]
-
-        # Start the subprocess
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # Stream straight away; only fall back to yt-dlp if streamlink can't start
+        process, first_chunk = start_streamlink(url)
+        if not first_chunk:
+            error_msg = _failed_stream_error(process)
+            if not _YT_RE.search(url):
+                return jsonify({'error': 'No valid streams found', 'details': error_msg}), 404
+
+            page_url = url
+            future = STREAM_PROBE_POOL.submit(resolve_youtube_url, page_url)
+            try:
+                yt_url = future.result(timeout=STREAM_PROBE_TIMEOUT)
+            except FuturesTimeoutError:
+                logging.error(f'Timed out resolving stream {url}')
+                return jsonify({'error': 'Timed out retrieving stream info'}), 504
+            if not yt_url:
+                return jsonify({'error': 'No valid streams found'}), 404
+
+            url = yt_url
+            process, first_chunk = start_streamlink(url)
+            if not first_chunk:
+                error_msg = _failed_stream_error(process)
+                # The cached resolution may be a dead manifest (e.g. the broadcast
+                # restarted under a new video ID), so ask yt-dlp again next time
+                _resolved_urls.pop(page_url, None)
+                return jsonify({'error': 'No valid streams found', 'details': error_msg}), 404
+
         client_ip = request.remote_addr
 
         def generate():
             try:
                 logging.info(f"Starting stream for client {client_ip} from {url}")
-                while True:
-                    data = process.stdout.read(4096)
-                    if not data:
-                        break
-                    yield data
+                yield first_chunk
+                # Relay chunks until streamlink closes stdout (os.read returns b'' at EOF)
+                yield from iter(partial(os.read, process.stdout.fileno(), STREAM_CHUNK_SIZE), b'')
             except GeneratorExit:
                 logging.info(f"Client {client_ip} disconnected from stream {url}")
                 process.terminate()
@@ -501,12 +729,14 @@ def stream():
                     process.kill()
                 finally:
                     process.stdout.close()
-                    process.stderr.close()
+                    if process.stderr:
+                        process.stderr.close()
             except Exception as e:
                 logging.error(f'Error in generator for {client_ip}: {str(e)}')
                 process.terminate()
                 process.stdout.close()
-                process.stderr.close()
+                if process.stderr:
+                    process.stderr.close()
 
         response = Response(generate(), content_type='video/mp2t')
         
@@ -521,7 +751,8 @@ def stream():
                     process.kill()
                 finally:
                     process.stdout.close()
-                    process.stderr.close()
+                    if process.stderr:
+                        process.stderr.close()
 
         return response
 
@@ -529,6 +760,21 @@ def stream():
         logging.error(f'Error occurred: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
+class GunicornServer(BaseApplication):
+    """Run the Flask app under gunicorn from this script, so startup work runs before serving."""
+
+    def __init__(self, application, options):
+        self.application = application
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
 if __name__ == '__main__':
     # Generate ytlive.m3u and EPG from ytlinks.xml at startup if the XML exists
     xml_path = os.path.join(M3U_DIR, 'ytlinks.xml')
@@ -543,4 +789,10 @@ if __name__ == '__main__':
     logging.info(f'HDHomeRun emulation active — Device ID: {DEVICE_ID}, Name: {HDHR_FRIENDLY_NAME}')
     logging.info(f'Add to Plex via: http://{HOST_IP}:{SERVER_PORT}')
 
-    app.run(host='0.0.0.0', port=int(SERVER_PORT))
\ No newline at end of file
+    # A single threaded worker keeps the in-process caches and probe pool shared by every request
+    GunicornServer(app, {
+        'bind': f'0.0.0.0:{SERVER_PORT}',
+        'worker_class': 'gthread',
+        'workers': 1,
+        'threads': SERVER_THREADS,
+    }).run()
\ No newline at end of file